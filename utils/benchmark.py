@@ -0,0 +1,253 @@
+""" Benchmarks for the Computational Assyriology utilities.
+
+Usage: python benchmark.py download [directory]
+       python benchmark.py parse file.zip
+       python benchmark.py json file.zip
+       python benchmark.py memory file.zip
+       python benchmark.py pack file.zip
+
+The ZIPs in `directory` (default: jsonzip) are served by a local
+stand-in HTTP server (see utils.serve_mirror()) or read directly
+through a file:// URL, so that network-bound behaviour can be
+measured deterministically without touching the ORACC servers.
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import json
+import zipfile
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import utils
+
+def timed(label, f, *args, **kwargs):
+    start = time.perf_counter()
+    result = f(*args, **kwargs)
+    print(f"{label:<40}{time.perf_counter() - start:8.3f} s")
+    return result
+
+def bench_download(directory = "jsonzip"):
+    """Times full downloads of all ZIPs in `directory`, a
+    second run in which the manifest allows every unchanged
+    ZIP to be skipped, a copy from a file:// mirror, and
+    sequential against concurrent downloads from a server
+    with a simulated latency of 0.2 seconds."""
+    directory = os.path.abspath(directory)
+    files = [f for f in os.listdir(directory) if f.endswith('.zip')]
+    # the stand-in server has no sub-directories, so
+    # 'dcclt-nineveh.zip' stands for project 'dcclt/nineveh'.
+    projects = [f[:-4].replace('-', '/') for f in files]
+    server, address = utils.serve_mirror(directory)
+    slow, slow_address = utils.serve_mirror(directory, latency=0.2)
+    cwd = os.getcwd()
+    work = tempfile.mkdtemp()
+    try:
+        os.chdir(work)
+        os.makedirs("jsonzip")
+        timed("download (cold)", utils.oracc_download, projects, address)
+        timed("download (manifest, unchanged)", utils.oracc_download, projects, address)
+        timed("download (forced)", utils.oracc_download, projects, address, force=True)
+        timed("file:// mirror (forced)", utils.oracc_download, projects,
+                Path(directory).as_uri(), force=True)
+        timed("latency 0.2 s, 1 worker", utils.oracc_download, projects, slow_address,
+                force=True)
+        timed("latency 0.2 s, 8 workers", utils.oracc_download, projects, slow_address,
+                workers=8, force=True)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work)
+        server.shutdown()
+        slow.shutdown()
+
+def parsejson_recursive(text, meta_d):
+    """The recursive parser that was replaced by utils.iter_lemmas(),
+    kept as a reference."""
+    l = []
+    capture_field = False
+    for JSONobject in text["cdl"]:
+        if "cdl" in JSONobject:
+            l.extend(parsejson_recursive(JSONobject, meta_d))
+        meta_d["label"] = JSONobject.get('label')
+        if JSONobject.get("type") == "cell-start":
+            capture_field = True
+        if JSONobject.get("type") == "cell-end":
+            capture_field = False
+        if capture_field:
+            if "subtype" in JSONobject:
+                meta_d["field"] = JSONobject["subtype"]
+        if "f" in JSONobject:
+            lemma = JSONobject["f"]
+            lemma["id_word"] = JSONobject["ref"]
+            lemma['label'] = meta_d["label"]
+            lemma["id_text"] = meta_d["id_text"]
+            lemma["ftype"] = JSONobject.get("ftype")
+            if capture_field:
+                lemma["field"] = meta_d.get("field", "")
+            l.append(lemma)
+        if JSONobject.get("strict") == "1":
+            lemma = {}
+            lemma['extent'] = JSONobject['extent']
+            lemma['scope'] = JSONobject['scope']
+            lemma['state'] = JSONobject['state']
+            lemma["id_word"] = JSONobject["ref"]
+            lemma["id_text"] = meta_d["id_text"]
+            l.append(lemma)
+    return l
+
+def load_texts(file):
+    """Returns the decoded JSON of all corpusjson members of a project ZIP."""
+    with zipfile.ZipFile(file) as z:
+        names = [name for name in z.namelist() if "corpusjson" in name and name[-5:] == '.json']
+        return [json.loads(z.read(name)) for name in names]
+
+def parse_all(parser, texts, keep = True):
+    meta_d = {"label": None, "id_text": "bench"}
+    rows = []
+    for text in texts:
+        parsed = parser(text, meta_d)
+        if keep:
+            rows.extend(parsed)
+    return rows
+
+def bench_parse(file):
+    """Compares the recursive reference parser with utils.parsejson()
+    on all texts of a project ZIP (decoded beforehand). Reports texts
+    per second (best of five rounds, alternating between the parsers)
+    and the peak memory allocated while parsing text by text, and
+    checks that both parsers produce the same rows."""
+    parsers = {"recursive parsejson" : parsejson_recursive, 
+               "iterative parsejson" : utils.parsejson}
+    texts = load_texts(file)
+    best = {label : float('inf') for label in parsers}
+    for run in range(5):
+        for label, parser in parsers.items():
+            start = time.perf_counter()
+            parse_all(parser, texts, keep=False)
+            best[label] = min(best[label], time.perf_counter() - start)
+    rows = {}
+    for label, parser in parsers.items():
+        tracemalloc.start()
+        parse_all(parser, texts, keep=False)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{label:<40}{len(texts) / best[label]:10.0f} texts/s   peak {peak / 2**10:10.1f} kB")
+        rows[label] = json.dumps(parse_all(parser, load_texts(file)))
+    assert len(set(rows.values())) == 1, "parsers differ"
+    # a single level with many containers (such as sentences) side by 
+    # side; the time per node should not grow with their number
+    for n in (16000, 64000):
+        times = {}
+        for label, parser in parsers.items():
+            text = wide_text(n)
+            start = time.perf_counter()
+            rows[label] = json.dumps(parser(text, {"label": None, "id_text": "bench"}))
+            times[label] = time.perf_counter() - start
+            print(f"{label + f' ({n} siblings)':<40}{times[label]:10.3f} s")
+        assert len(set(rows.values())) == 1, "parsers differ"
+
+def wide_text(n):
+    """Returns a text with `n` sentence nodes at one level, each with
+    a line start and one word."""
+    return {"cdl" : [{"node" : "c", "type" : "sentence", "cdl" : [
+                        {"node" : "d", "type" : "line-start", "label" : f"o {i}"},
+                        {"node" : "l", "ref" : f"bench.{i}.1", "f" : {"form" : "lugal"}}]}
+                     for i in range(n)]}
+
+def bench_json(file):
+    """Compares JSON decoders on the corpusjson members and the
+    catalogue.json of a project ZIP (read into memory beforehand):
+    the standard library on a decoded string (the old way), the
+    standard library on the raw bytes, and orjson (if installed)
+    on the raw bytes. Reports MB per second, best of five rounds."""
+    decoders = {"json.loads(bytes.decode())" : lambda b: json.loads(b.decode('utf-8')),
+                "json.loads(bytes)" : json.loads}
+    try:
+        import orjson
+        decoders["orjson.loads(bytes)"] = orjson.loads
+    except ImportError:
+        print("orjson is not installed")
+    with zipfile.ZipFile(file) as z:
+        names = z.namelist()
+        members = {"corpusjson" : [z.read(name) for name in names 
+                                   if "corpusjson" in name and name[-5:] == '.json'],
+                   "catalogue.json" : [z.read(name) for name in names 
+                                       if name.endswith('catalogue.json')]}
+    for shape, docs in members.items():
+        size = sum(len(doc) for doc in docs)
+        if not size:
+            continue
+        print(f"{shape}: {len(docs)} members, {size / 2**20:.1f} MB")
+        expected = [json.loads(doc) for doc in docs]
+        for label, decode in decoders.items():
+            best = float('inf')
+            for run in range(5):
+                start = time.perf_counter()
+                for doc in docs:
+                    decode(doc)
+                best = min(best, time.perf_counter() - start)
+            assert [decode(doc) for doc in docs] == expected, f"{label} differs"
+            print(f"  {label:<38}{size / 2**20 / best:10.1f} MB/s")
+
+def bench_memory(file):
+    """Reports the memory retained per million tokens by the
+    parsed texts of a project ZIP: a list with the full lemma
+    dictionaries (utils.parsejson()) against the per-column lists
+    with interned strings (utils.columns_from_rows())."""
+    project = os.path.basename(file)[:-4].replace('-', '/')
+    with zipfile.ZipFile(file) as z:
+        names = [name for name in z.namelist() if "corpusjson" in name and name[-5:] == '.json']
+        for label, columns in (("list of lemmas", None), ("columns", utils.COLUMNS)):
+            meta_d = {"label": None, "id_text": None}
+            tracemalloc.start()
+            lemm = utils.new_lemmas(columns)
+            for name in names:
+                utils.add_text(lemm, utils.parse_member(z, project, name, meta_d, columns))
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            tokens = len(lemm["id_word"]) if columns else len(lemm)
+            print(f"{label:<40}{current / tokens * 1e6 / 2**20:10.0f} MB per million tokens")
+            del lemm
+
+def bench_pack(file):
+    """Reads all corpusjson members of a project ZIP and parses 
+    them with utils.get_lemmas(), first from the ZIP and then 
+    from a pack made of it (utils.pack_project()), in a copy of
+    the ZIP in a temporary directory."""
+    project = os.path.basename(file)[:-4].replace('-', '/')
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.makedirs(f"{tmp}/jsonzip")
+        shutil.copy(file, f"{tmp}/jsonzip/{os.path.basename(file)}")
+        os.chdir(tmp)
+        try:
+            archives = {"ZIP" : utils.project_archive(project)}
+            archives["pack"] = timed("pack_project()", utils.pack_project, project)
+            for label, archive in archives.items():
+                with utils.open_archive(archive) as z:
+                    names = [name for name in z.namelist() 
+                                if "corpusjson" in name and name[-5:] == '.json']
+                    timed(f"read members from {label}", lambda: [z.read(name) for name in names])
+            for label, archive in archives.items():
+                if label == "ZIP":  # a ZIP that changed after the pack was made is read instead
+                    os.utime(f"jsonzip/{os.path.basename(file)}")
+                else:
+                    utils.pack_project(project)
+                assert utils.project_archive(project) == archive
+                timed(f"get_lemmas() from {label}", utils.get_lemmas, [project], columns=utils.COLUMNS)
+        finally:
+            os.chdir(cwd)
+
+if __name__ == "__main__":
+    benchmarks = {"download" : bench_download, 
+                  "parse" : bench_parse,
+                  "json" : bench_json,
+                  "memory" : bench_memory,
+                  "pack" : bench_pack}
+    if len(sys.argv) < 2 or sys.argv[1] not in benchmarks:
+        print(__doc__)
+        sys.exit(1)
+    benchmarks[sys.argv[1]](*sys.argv[2:])
@@ -1,108 +1,1201 @@
 """ Utilities for Computational Assyriology """
 import requests
+import urllib3
 from tqdm.auto import tqdm
 import os
 import sys
 import zipfile
 import json
+import pickle
 import sys
+import hashlib
+import time
+import threading
+import queue
+import io
+import csv
+import tarfile
+import re
+import mmap
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+from email.utils import parsedate_to_datetime, formatdate
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from itertools import chain
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from collections.abc import Mapping
 import pandas as pd
+import numpy as np
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    import pyarrow.feather as feather
+except ImportError:  # pyarrow is only needed for save_corpus() and load_corpus()
+    pa = None
+try:
+    import orjson
+    loads = orjson.loads
+except ImportError:  # the standard library decodes bytes too, only slower
+    loads = json.loads
 
 def format_project_list(projects):
     project_list = projects.lower().strip().split(',')
     project_list = [project.strip() for project in project_list]
     return(project_list)
 
-def oracc_download(project_list, server = 'penn'):
+MANIFEST = "jsonzip/manifest.json"
+TIMEOUT = 60 # seconds without data before a connection counts as lost
+HEALTH = "jsonzip/mirrors.json"
+HEALTH_LOCK = threading.Lock()
+MIRRORS = {"penn" : "https://oracc.museum.upenn.edu/json/{proj}.zip", 
+           "build" : "https://build-oracc.museum.upenn.edu/json/{proj}.zip",
+           "lmu" : "http://oracc.ub.uni-muenchen.de/{project}/json/{proj}.zip"}
+
+def read_manifest():
+    """Returns the manifest of the ZIPs in jsonzip
+    as a dictionary with project names as keys. Each
+    entry records the URL, ETag, Last-Modified, 
+    content-length and SHA-1 hash of the file, and the
+    size and modification time of the file on disk."""
+    try:
+        with open(MANIFEST, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def write_manifest(manifest):
+    with open(MANIFEST, 'w', encoding='utf-8') as w:
+        json.dump(manifest, w, indent=1, sort_keys=True)
+
+def file_hash(file):
+    h = hashlib.sha1()
+    with open(file, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def stamp(file, entry):
+    """Records the size and modification time of `file` 
+    in its manifest `entry`."""
+    st = os.stat(file)
+    entry["size"], entry["mtime_ns"] = st.st_size, st.st_mtime_ns
+
+def unchanged(file, entry):
+    """Returns True if `file` is the file recorded in its
+    manifest `entry`. The file is hashed only if its size 
+    or modification time differ from those recorded; if
+    the hash is the same, the new ones are recorded."""
+    st = os.stat(file)
+    if [st.st_size, st.st_mtime_ns] == [entry.get("size"), entry.get("mtime_ns")]:
+        return True
+    if file_hash(file) != entry["sha1"]:
+        return False
+    stamp(file, entry)
+    return True
+
+def zip_ok(file):
+    """Returns True if `file` is a complete ZIP
+    in which all members pass their CRC check."""
+    try:
+        with zipfile.ZipFile(file) as z:
+            return z.testzip() is None
+    except (zipfile.BadZipFile, OSError):
+        return False
+
+# All downloads (ORACC, ETCSL, BDTNS, OGSL, CDLI) go through 
+# download(), which shares one pooled requests.Session.
+SESSION = None
+SESSION_LOCK = threading.Lock()
+TRANSFERS = [] # metrics of every transfer; see download()
+
+def session():
+    """Returns the shared requests.Session. Its connection
+    pool keeps connections to each server open from one 
+    download to the next."""
+    global SESSION
+    with SESSION_LOCK:
+        if SESSION is None:
+            SESSION = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=16)
+            SESSION.mount('http://', adapter)
+            SESSION.mount('https://', adapter)
+    return SESSION
+
+def chunks(r, size = 1 << 16, largest = 1 << 23):
+    """Yields the body of the response `r` in chunks that
+    start at 64 kB and double in size (up to 8 MB) as long 
+    as each chunk arrives within a quarter of a second."""
+    while True:
+        start = time.perf_counter()
+        c = r.raw.read(size, decode_content=True)
+        if not c:
+            return
+        yield c
+        if size < largest and time.perf_counter() - start < 0.25:
+            size *= 2
+
+def resume_download(r, url, part, bar, verify = True, retries = 5):
+    """Writes the body of the response `r` to the file 
+    `part`. When the connection drops, the download is 
+    resumed with an HTTP Range request from the last byte
+    received, rather than restarted from byte zero. 
+    The progress bar is updated at most five times per 
+    second. Returns the SHA-1 hash of the complete file 
+    (None if the file could not be completed) and the 
+    number of bytes received."""
+    total_size = int(r.headers.get('content-length', 0))
+    # If-Range makes the server send the whole file again 
+    # (status 200) if it changed in the meantime.
+    validator = r.headers.get("ETag") or r.headers.get("Last-Modified")
+    h = hashlib.sha1()
+    size = received = pending = 0
+    shown = time.perf_counter()
+    attempt = 0
+    with open(part, 'wb') as f:
+        while True:
+            try:
+                for c in chunks(r):
+                    f.write(c)
+                    h.update(c)
+                    size += len(c)
+                    pending += len(c)
+                    if time.perf_counter() - shown > 0.2:
+                        bar.update(pending)
+                        received += pending
+                        pending = 0
+                        shown = time.perf_counter()
+                if size >= total_size:
+                    return h.hexdigest(), size
+            except (requests.exceptions.RequestException, urllib3.exceptions.HTTPError):
+                pass
+            finally:
+                bar.update(pending)
+                received += pending
+                pending = 0
+                if attempt: # the first response is closed by the caller
+                    r.close()
+            attempt += 1
+            if attempt > retries:
+                return None, size
+            tqdm.write(f"Connection lost; resuming {url} at byte {size}.")
+            headers = {"Range" : f"bytes={size}-", "Accept-Encoding" : "identity"}
+            if validator:
+                headers["If-Range"] = validator
+            try:
+                r = session().get(url, stream=True, verify=verify, headers=headers, timeout=TIMEOUT)
+            except requests.exceptions.RequestException:
+                return None, size
+            if r.status_code == 200:  # no partial content: start again
+                f.seek(0)
+                f.truncate()
+                bar.update(-received)
+                h = hashlib.sha1()
+                size = received = 0
+            elif r.status_code != 206:
+                r.close()
+                return None, size
+
+def progress_bar(bar, total_size, desc):
+    """Returns a new progress bar for a transfer of 
+    `total_size` bytes, or adds `total_size` to the 
+    total of the existing progress bar `bar`."""
+    if bar is None:
+        return tqdm(total=total_size, unit='B', unit_scale=True, desc = desc)
+    with bar.get_lock():
+        bar.total += total_size
+        bar.refresh()
+    return bar
+
+def finish_download(url, part, file, sha1, check):
+    """Replaces `file` by the temporary file `part` if
+    the download is complete and passes `check`. Returns
+    True on success; otherwise `part` is removed."""
+    if sha1 is None or (check and not check(part)):
+        tqdm.write(f"WARNING {url} could not be downloaded completely.")
+        if os.path.exists(part):
+            os.remove(part)
+        return False
+    os.replace(part, file)
+    return True
+
+def http_fetch(url, file, metrics, desc, bar, headers, check, verify):
+    """Fetch backend for http:// and https:// URLs,
+    using the shared session."""
+    # no gzip or deflate: Content-Length and the Range offsets 
+    # of resume_download() must count the bytes of the file
+    headers = {"Accept-Encoding" : "identity", **(headers or {})}
+    start = time.perf_counter()
+    try:
+        r = session().get(url, stream=True, verify=verify, headers=headers, timeout=TIMEOUT)
+    except requests.exceptions.RequestException:
+        e = sys.exc_info() # get error information
+        tqdm.write(f"WARNING {url}: {e[1]}")
+        return
+    with r:
+        metrics["latency"] = time.perf_counter() - start
+        metrics["status"] = r.status_code
+        if r.status_code == 200:
+            tqdm.write(f"Saving {url} as {file}.")
+            total_size = int(r.headers.get('content-length', 0))
+            metrics["etag"] = r.headers.get("ETag")
+            metrics["last_modified"] = r.headers.get("Last-Modified")
+            metrics["content_length"] = total_size
+            t = progress_bar(bar, total_size, desc)
+            part = f"{file}.part"
+            sha1, metrics["bytes"] = resume_download(r, url, part, t, verify)
+            if bar is None:
+                t.close()
+            if finish_download(url, part, file, sha1, check):
+                metrics["sha1"] = sha1
+
+def file_fetch(url, file, metrics, desc, bar, headers, check, verify):
+    """Fetch backend for file:// URLs, for instance a 
+    directory with ZIPs that were staged beforehand on
+    a machine without internet access. It answers like
+    an HTTP server would: status 404 for a missing file,
+    304 if the file did not change since the ETag or 
+    Last-Modified date in `headers`."""
+    CHUNK = 1 << 23
+    start = time.perf_counter()
+    path = url2pathname(urlparse(url).path)
+    if not os.path.isfile(path):
+        metrics["status"] = 404
+        return
+    st = os.stat(path)
+    etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+    last_modified = formatdate(st.st_mtime, usegmt=True)
+    metrics["latency"] = time.perf_counter() - start
+    headers = headers or {}
+    if headers.get("If-None-Match") == etag or headers.get("If-Modified-Since") == last_modified:
+        metrics["status"] = 304
+        return
+    metrics["status"] = 200
+    metrics["etag"] = etag
+    metrics["last_modified"] = last_modified
+    metrics["content_length"] = st.st_size
+    tqdm.write(f"Copying {path} to {file}.")
+    t = progress_bar(bar, st.st_size, desc)
+    part = f"{file}.part"
+    h = hashlib.sha1()
+    with open(path, 'rb') as f, open(part, 'wb') as w:
+        for c in iter(lambda: f.read(CHUNK), b''):
+            w.write(c)
+            h.update(c)
+            t.update(len(c))
+            metrics["bytes"] += len(c)
+    if bar is None:
+        t.close()
+    if finish_download(url, part, file, h.hexdigest(), check):
+        metrics["sha1"] = h.hexdigest()
+
+# Fetch backends by URL scheme. A backend is called as 
+# backend(url, file, metrics, desc, bar, headers, check, verify)
+# and fills in the dictionary `metrics` (see download()).
+BACKENDS = {"http" : http_fetch, "https" : http_fetch, "file" : file_fetch}
+
+def download(url, file, desc = None, bar = None, headers = None, check = None, verify = True):
+    """Downloads `url` and saves it as `file`, with the 
+    backend in BACKENDS that handles the URL scheme 
+    (http://, https:// or file://). The data go to a 
+    temporary file that replaces `file` only when the 
+    transfer is complete and (if a function `check` is 
+    given) check(temporary file) returns True. Progress
+    is shown in a new progress bar, labeled `desc`, or 
+    added to an existing bar `bar`. Returns a dictionary
+    with the metrics of the transfer: HTTP status, bytes
+    received, latency (seconds to the response headers),
+    duration and throughput (bytes per second), the ETag,
+    Last-Modified and content-length headers, and the 
+    SHA-1 hash of the saved file (None if nothing was 
+    saved). The same dictionary is added to the list 
+    TRANSFERS."""
+    metrics = {"url" : url, "file" : file, "status" : None, "bytes" : 0, 
+               "latency" : None, "seconds" : None, "throughput" : None, 
+               "etag" : None, "last_modified" : None, "content_length" : 0,
+               "sha1" : None}
+    start = time.perf_counter()
+    backend = BACKENDS[urlparse(url).scheme]
+    backend(url, file, metrics, desc or file, bar, headers, check, verify)
+    metrics["seconds"] = time.perf_counter() - start
+    if metrics["bytes"]:
+        metrics["throughput"] = metrics["bytes"] / metrics["seconds"]
+    TRANSFERS.append(metrics)
+    return metrics
+
+class MirrorServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class MirrorHandler(SimpleHTTPRequestHandler):
+    """Request handler of the stand-in server. It serves
+    the files in the directory `root` (not in its 
+    subdirectories). `latency` (seconds before each 
+    response) and `bandwidth` (bytes per second) simulate
+    a remote server."""
+    root = "jsonzip"
+    latency = 0
+    bandwidth = None
+
+    def translate_path(self, path):
+        name = os.path.basename(url2pathname(urlparse(path).path))
+        return os.path.join(self.root, name)
+
+    def send_head(self):
+        time.sleep(self.latency)
+        return super().send_head()
+
+    def copyfile(self, source, outputfile):
+        if not self.bandwidth:
+            return super().copyfile(source, outputfile)
+        CHUNK = 1 << 16
+        for c in iter(lambda: source.read(CHUNK), b''):
+            outputfile.write(c)
+            time.sleep(len(c) / self.bandwidth)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve_mirror(directory = "jsonzip", port = 0, latency = 0, bandwidth = None):
+    """Starts a local stand-in server for ORACC that serves
+    the ZIPs in `directory` over HTTP, in a background thread.
+    Returns the server (stop it with server.shutdown()) and 
+    its address, which can be used as the `server` argument
+    of oracc_download() and get_data(). With `port` = 0 a
+    free port is chosen."""
+    handler = type("Handler", (MirrorHandler,), {"root" : os.path.abspath(directory),
+                                                 "latency" : latency, "bandwidth" : bandwidth})
+    server = MirrorServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+def server_urls(project, server = 'penn', health = None):
+    """Returns the list of URLs where the ZIP of 
+    `project` may be found, in the order in which
+    they are tried. `server` is 'penn', 'lmu', 'race'
+    (all mirrors, those with the best record in `health`
+    first; see race_mirrors()) or the address of a 
+    server or directory that holds all ZIPs in one 
+    place (for instance a local stand-in server such as
+    'http://localhost:8000', see serve_mirror(), or a 
+    directory such as 'file:///data/oracc')."""
+    proj = project.replace('/', '-')
+    if server.startswith(('http', 'file')):
+        return [f"{server.rstrip('/')}/{proj}.zip"]
+    if server == 'race':
+        order = sorted(MIRRORS, key = lambda mirror: mirror_score(mirror, health))
+    elif server == 'lmu':
+        order = ['lmu', 'penn', 'build']
+    else:
+        order = ['penn', 'build']
+    return [MIRRORS[mirror].format(project=project, proj=proj) for mirror in order]
+
+def read_health():
+    """Returns the record of mirror health kept in 
+    jsonzip/mirrors.json: for each mirror the average
+    response time, the number of consecutive failures
+    and the time of the last failure."""
+    try:
+        with open(HEALTH, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def write_health(health):
+    with open(HEALTH, 'w', encoding='utf-8') as w:
+        json.dump(health, w, indent=1, sort_keys=True)
+
+def mirror_score(mirror, health = None):
+    """Returns the expected response time of a mirror,
+    based on earlier probes. Mirrors that failed three 
+    times in a row during the last hour come last."""
+    record = (health or {}).get(mirror)
+    if record is None:
+        return 1.0
+    if record["failures"] >= 3 and time.time() - record["last_failure"] < 3600:
+        return float('inf')
+    return record["latency"]
+
+def probe(url):
+    """Sends a HEAD request to `url`. Returns the HTTP
+    status (None if the server could not be reached), 
+    the response time in seconds and the Last-Modified
+    date as a timestamp (0 if not given)."""
+    start = time.perf_counter()
+    try:
+        r = session().head(url, verify=False, timeout=10, allow_redirects=True)
+    except requests.exceptions.RequestException:
+        return None, time.perf_counter() - start, 0
+    latency = time.perf_counter() - start
+    modified = 0
+    if r.headers.get("Last-Modified"):
+        try:
+            modified = parsedate_to_datetime(r.headers["Last-Modified"]).timestamp()
+        except (TypeError, ValueError):
+            pass
+    return r.status_code, latency, modified
+
+def race_mirrors(project, health = None, prefer = 'fastest'):
+    """Probes all ORACC mirrors at the same time with HEAD
+    requests for the ZIP of `project`. Returns the URLs 
+    of the mirrors that have the file, either the fastest 
+    (`prefer` = 'fastest') or the most recent version
+    (`prefer` = 'newest') first. The response times and
+    failures are recorded in the dictionary `health`, so 
+    that slow or unavailable mirrors can be recognized in
+    the next run. Mirrors that did not answer the HEAD 
+    request, or answered with another status than 200 or
+    404 (for instance 405, HEAD not allowed), follow 
+    those, in the order of their record, to be tried with
+    a GET request. The list is empty if all mirrors answer
+    that the file does not exist; if no mirror answers the
+    HEAD request at all, all URLs are returned in the 
+    order of their record."""
+    if health is None:
+        health = {}
+    proj = project.replace('/', '-')
+    urls = {mirror : url.format(project=project, proj=proj) for mirror, url in MIRRORS.items()}
+    mirrors = [mirror for mirror in MIRRORS if mirror_score(mirror, health) < float('inf')]
+    with ThreadPoolExecutor(max_workers=len(MIRRORS)) as executor:
+        results = dict(zip(mirrors, executor.map(lambda mirror: probe(urls[mirror]), mirrors)))
+    with HEALTH_LOCK:
+        for mirror, (status, latency, modified) in results.items():
+            record = health.setdefault(mirror, {"latency" : latency, "failures" : 0, "last_failure" : 0})
+            if status is None or status >= 500:
+                record["failures"] += 1
+                record["last_failure"] = time.time()
+            else:
+                record["failures"] = 0
+                # running average that follows recent response times
+                record["latency"] = 0.7 * record["latency"] + 0.3 * latency
+    found = [mirror for mirror, (status, latency, modified) in results.items() if status == 200]
+    if prefer == 'newest':
+        found.sort(key = lambda mirror: (-results[mirror][2], results[mirror][1]))
+    else:
+        found.sort(key = lambda mirror: results[mirror][1])
+    answered = [mirror for mirror, (status, latency, modified) in results.items() 
+                    if status is not None and status < 500 and status != 405]
+    if not found and not answered:
+        return server_urls(project, 'race', health)
+    # the file may still be there: these are tried last, with GET
+    fallback = sorted((mirror for mirror, (status, latency, modified) in results.items() 
+                           if status not in (200, 404, 410)),
+                      key = lambda mirror: mirror_score(mirror, health))
+    return [urls[mirror] for mirror in found + fallback]
+
+def download_project(project, server = 'penn', t = None, slots = None, manifest = None, 
+                     health = None, prefer = 'fastest'):
+    """Downloads the ZIP of a single ORACC project
+    into the directory jsonzip. Returns True if the 
+    project was found, False otherwise. If `t` (a tqdm 
+    progress bar) is given, progress is added to that 
+    bar instead of a new one. `slots` is a dictionary
+    of semaphores (one per server) that limits the 
+    number of simultaneous connections to each server.
+    If `manifest` is given, a conditional request is
+    sent for a ZIP that is already in jsonzip and
+    the download is skipped if the file did not 
+    change on the server; the manifest is updated
+    after each new download. If `server` is 'race',
+    the mirrors are probed first and the project is
+    downloaded from the fastest or the newest mirror
+    (see race_mirrors())."""
+    
+    proj = project.replace('/', '-')
+    file = f"jsonzip/{proj}.zip"
+    headers = {}
+    entry = manifest.get(project) if manifest else None
+    if entry and os.path.exists(file) and unchanged(file, entry):
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+    if server == 'race':
+        servers = race_mirrors(project, health, prefer)
+        if not servers:
+            tqdm.write(f"WARNING {project} does not exist on any mirror.")
+            return False
+    else:
+        servers = server_urls(project, server)
+    for url in servers:
+        host = urlparse(url).netloc
+        slot = slots[host] if slots else threading.Lock() # a new lock never blocks
+        with slot:
+            m = download(url, file, desc=project, bar=t, headers=headers, check=zip_ok, verify=False)
+        if m["status"] == 304:  # not modified
+            tqdm.write(f"{file} is up to date.")
+            return True
+        if m["sha1"]:
+            if manifest is not None:
+                manifest[project] = {key : m[key] for key in 
+                                        ["url", "etag", "last_modified", "content_length", "sha1"]}
+                stamp(file, manifest[project])
+            return True
+    tqdm.write(f"WARNING {url} does not exist.") #last server in the list was tried
+    return False
+
+def oracc_download(project_list, server = 'penn', workers = 1, connections = 4, force = False,
+                   prefer = 'fastest', callback = None):
     """Downloads ZIP with JSON files from
     ORACC servers. First parameter is a list
     with ORACC project names,
     return is the same list of names,
     minus doublets and non-existing
     projects. Second parameter is 'lmu' 
-    (first try LMU server) or 'penn' 
-    (default: first try Penn server)."""
+    (first try LMU server), 'penn' 
+    (default: first try Penn server),
+    'race' (probe all mirrors and download
+    from the fastest, or, with `prefer` = 
+    'newest', from the one with the most 
+    recent file), or the address of a local
+    mirror, such as 'file:///data/oracc' or
+    'http://localhost:8000' (see server_urls()).
+    `workers` is the number of projects that
+    are downloaded at the same time (default: 1,
+    one project after the other); `connections`
+    is the maximum number of simultaneous 
+    connections to a single server.
+    ZIPs that have not changed on the server
+    since the last download are not downloaded
+    again, unless `force` is True. If a function
+    `callback` is given, it is called with the
+    name of each project as soon as its ZIP is
+    ready."""
     
-    CHUNK = 1024
-    project_list = list(set(project_list)) #remove duplicates
-    projects = project_list.copy()
-    # the list projects will be changed by the for loop,
-    # removing non-existing project names (and then returned).
-    # Therefore, it has to be different from project_list, 
-    # which is iterated over in the loop.
-    for project in project_list:
-        proj = project.replace('/', '-')
-        build = f"https://build-oracc.museum.upenn.edu/json/{proj}.zip"
-        oracc = f"https://oracc.museum.upenn.edu/json/{proj}.zip"
-        #lmu = f"http://oracc.ub.uni-muenchen.de/{project}/json/{proj}.zip"
-        file = f"jsonzip/{proj}.zip"
-        servers = [oracc, build]
-        # if server == 'lmu':
-        #    servers = [lmu, oracc, build]
-        for url in servers:
-            with requests.get(url, stream=True, verify=False) as r:
-                if r.status_code == 200:
-                    tqdm.write(f"Saving {url} as {file}.")
-                    total_size = int(r.headers.get('content-length', 0))
-                    t=tqdm(total=total_size, unit='B', unit_scale=True, desc = project)
-                    with open(file, 'wb') as f:
-                        for c in r.iter_content(chunk_size=CHUNK):
-                            t.update(len(c))
-                            f.write(c)
-                    break
-                else:
-                    if url == servers[-1]: #last server in the list was tried
-                        tqdm.write(f"WARNING {url} does not exist.")
-                        projects.remove(project)
+    project_list = list(dict.fromkeys(project_list)) #remove duplicates, keeping the order
+    manifest = read_manifest()
+    health = read_health()
+    if force:
+        manifest = {project : entry for project, entry in manifest.items() 
+                        if project not in project_list}
+    def fetch(project, t = None, slots = None):
+        ok = download_project(project, server, t, slots, manifest, health, prefer)
+        if ok and callback:
+            callback(project)
+        return ok
+    if workers <= 1:
+        found = [fetch(project) for project in project_list]
+    else:
+        # one semaphore per server, so that no server receives
+        # more than `connections` requests at the same time.
+        hosts = {urlparse(url).netloc for project in project_list 
+                    for url in server_urls(project, server)}
+        slots = {host : threading.BoundedSemaphore(connections) for host in hosts}
+        # a single progress bar for all projects; its total grows 
+        # as the size of each ZIP becomes known.
+        t = tqdm(total=0, unit='B', unit_scale=True, desc = f"{len(project_list)} projects")
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            found = list(executor.map(lambda project: fetch(project, t, slots), project_list))
+        t.close()
+    write_manifest(manifest)
+    if server == 'race':
+        write_health(health)
+    projects = [project for project, ok in zip(project_list, found) if ok]
     return projects
 
-def parsejson(text, meta_d):
-    l = []
+def pack_file(project):
+    return f"jsonzip/{project.replace('/', '-')}.pack"
+
+def pack_project(project):
+    """Converts the ZIP of a downloaded project into a 
+    pack: a file with the members of the ZIP one after 
+    the other, uncompressed, and an index (the pack's 
+    name + .index.json) with the offset, size, and CRC 
+    of each member and the size and time of the ZIP it 
+    was made from. A pack takes more disk space than the
+    ZIP, but its members are read without inflating 
+    them. Returns the name of the pack."""
+    zip_file = f"jsonzip/{project.replace('/', '-')}.zip"
+    file = pack_file(project)
+    stat = os.stat(zip_file)
+    members = {}
+    offset = 0
+    with zipfile.ZipFile(zip_file) as z, open(f"{file}.part", 'wb') as w:
+        for info in z.infolist():
+            if info.is_dir():
+                continue
+            data = z.read(info)
+            w.write(data)
+            members[info.filename] = [offset, len(data), info.CRC]
+            offset += len(data)
+    index = {"zip" : [stat.st_size, stat.st_mtime_ns], "members" : members}
+    with open(f"{file}.index.json.part", 'w', encoding='utf-8') as w:
+        json.dump(index, w)
+    os.replace(f"{file}.part", file)
+    os.replace(f"{file}.index.json.part", f"{file}.index.json")
+    return file
+
+def pack_projects(projects):
+    """Makes a pack (see pack_project()) of each of the 
+    downloaded `projects` (a string with project names, 
+    separated by commas, or a list) that has no pack or
+    whose ZIP changed since. Once made, the pack is 
+    read instead of the ZIP by get_lemmas(), 
+    get_catalogue(), and the other functions that open
+    a project (see project_archive())."""
+    if isinstance(projects, str):
+        projects = format_project_list(projects)
+    for project in tqdm(projects, desc = "Packing"):
+        if project_archive(project) != pack_file(project):
+            pack_project(project)
+
+def project_archive(project):
+    """Returns the file to read a downloaded project 
+    from: its pack, if there is one made from the 
+    current ZIP (or the ZIP is gone), or else its ZIP."""
+    zip_file = f"jsonzip/{project.replace('/', '-')}.zip"
+    file = pack_file(project)
+    try:
+        with open(f"{file}.index.json", 'rb') as f:
+            made_from = loads(f.read())["zip"]
+    except (OSError, ValueError, KeyError):
+        return zip_file
+    try:
+        stat = os.stat(zip_file)
+    except OSError:
+        return file
+    return file if made_from == [stat.st_size, stat.st_mtime_ns] else zip_file
+
+def open_archive(file):
+    """Opens a project ZIP or pack (see project_archive())."""
+    return Pack(file) if file.endswith(".pack") else zipfile.ZipFile(file)
+
+class Pack:
+    """Reads a pack (see pack_project()) like a ZipFile
+    (namelist(), infolist(), getinfo(), read()). The 
+    pack is memory-mapped: a member is a slice of the 
+    mapped file, read by the operating system (from its
+    page cache, if it was read before) and never 
+    inflated. If the JSON decoder accepts memoryviews 
+    (orjson does), read() returns a memoryview of the 
+    mapping, which is decoded without a copy; otherwise
+    (json.loads) the member is copied into bytes."""
+
+    def __init__(self, file):
+        with open(f"{file}.index.json", 'rb') as f:
+            self.members = loads(f.read())["members"]
+        self.file = open(file, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        try:    # orjson decodes memoryviews; json.loads (and old orjson) need bytes
+            loads(memoryview(b'0'))
+            self.view = memoryview(self.map)
+        except (TypeError, ValueError):
+            self.view = None
+
+    def namelist(self):
+        return list(self.members)
+
+    def getinfo(self, name):
+        offset, size, crc = self.members[name]
+        info = zipfile.ZipInfo(name)
+        info.CRC = crc
+        info.file_size = info.compress_size = size
+        return info
+
+    def infolist(self):
+        return [self.getinfo(name) for name in self.members]
+
+    def read(self, name):
+        if isinstance(name, zipfile.ZipInfo):
+            name = name.filename
+        offset, size, crc = self.members[name]
+        if self.view is not None:
+            return self.view[offset:offset + size]
+        return self.map[offset:offset + size]
+
+    def close(self):
+        if self.view is not None:
+            self.view.release()
+        if isinstance(self.map, mmap.mmap):
+            try:
+                self.map.close()
+            except BufferError:  # a member is still in use; unmapped when it is gone
+                pass
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# the fields of a lemma that are kept by default
+COLUMNS = ['id_text', 'id_word', 'label', 'cf', 'gw', 'pos', 'form', 'norm', 'sense', 
+           'lang', 'field', 'ftype', 'extent', 'scope', 'state']
+
+def iter_lemmas(text, meta_d, carry_label = False):
+    """Walks the `cdl` tree of an ORACC text and yields
+    one dictionary for each lemma and for each break or
+    ruling, in text order. Instead of recursion (a new 
+    list at every level of nesting) the walker keeps an
+    explicit stack, so that deeply nested texts do not
+    run into the recursion limit. The dictionary `meta_d`
+    carries `id_text`, the line label and the field; the
+    label of the last node is stored in it at the end.
+    Word nodes have no label of their own; with 
+    `carry_label` = True a lemma gets the label of the 
+    last node that had one (the line-start node, for 
+    instance "o i 1'"), as in the parser of 2.1.4, 
+    starting afresh in each text."""
+    # the stack holds, for each level above the current one, the
+    # iterator over its `cdl` list, its capture_field flag, and the
+    # node whose children are being walked. That node is processed
+    # after its children, at its own level: it is walked on its own,
+    # above a marker (the same iterator, with None for the node) that
+    # goes on with the rest of the level, so that the iterator is
+    # never wrapped (wrapping it once for each container would make
+    # every step slower as the number of siblings grows).
+    stack = []
+    nodes = iter(text["cdl"])
     capture_field = False
-    for JSONobject in text["cdl"]:
-        if "cdl" in JSONobject: 
-            l.extend(parsejson(JSONobject, meta_d))
-        
-        meta_d["label"] = JSONobject.get('label')
-       # if "type" in JSONobject and JSONobject["type"] == "field-start": # this is for sign lists, identifying fields such as
-       #     meta_d["field"] = JSONobject["subtype"]                    # sign, pronunciation, translation.
-        if JSONobject.get("type") == "cell-start":
-            capture_field = True
-        if JSONobject.get("type") == "cell-end":
-            capture_field = False
-        if capture_field:
-            if "subtype" in JSONobject:
-                meta_d["field"] = JSONobject["subtype"]                    # sign, pronunciation, translation.
-                
-        #if "type" in JSONobject and JSONobject["type"] == "field-end":
-        #    meta_d.pop("field", None)                           # remove the key "field" to prevent it from being copied 
-                                                              # to all subsequent lemmas (which may not have fields)
-        if "f" in JSONobject:
-            lemma = JSONobject["f"]
-            lemma["id_word"] = JSONobject["ref"]
-            lemma['label'] = meta_d["label"]
-            lemma["id_text"] = meta_d["id_text"]
-            lemma["ftype"] = JSONobject.get("ftype")   # capturing words that belong to yearnames
+    walked = None
+    id_text = meta_d["id_text"]
+    label = None if carry_label else meta_d["label"]
+    while True:
+        for JSONobject in nodes:
+            if "cdl" in JSONobject and JSONobject is not walked:
+                stack.append((nodes, capture_field, JSONobject))
+                nodes = iter(JSONobject["cdl"])
+                capture_field = False
+                break
+            if not carry_label or 'label' in JSONobject:
+                label = JSONobject.get('label')
+            node_type = JSONobject.get("type")
+            if node_type == "cell-start":
+                capture_field = True
+            elif node_type == "cell-end":
+                capture_field = False
             if capture_field:
-                lemma["field"] = meta_d.get("field", "")
-            l.append(lemma)
-        if JSONobject.get("strict") == "1":
-            lemma = {}
-            lemma['extent'] = JSONobject['extent']
-            lemma['scope'] = JSONobject['scope']
-            lemma['state'] = JSONobject['state']
-            lemma["id_word"] = JSONobject["ref"]
-            lemma["id_text"] = meta_d["id_text"]
-            l.append(lemma)
-    return l
-
-def get_lemmas(project_list):
-    lemm_l = []
+                if "subtype" in JSONobject:
+                    meta_d["field"] = JSONobject["subtype"]    # sign, pronunciation, translation.
+            if "f" in JSONobject:
+                lemma = JSONobject["f"]
+                lemma["id_word"] = JSONobject["ref"]
+                lemma['label'] = label
+                lemma["id_text"] = id_text
+                lemma["ftype"] = JSONobject.get("ftype")   # capturing words that belong to yearnames
+                if capture_field:
+                    lemma["field"] = meta_d.get("field", "")
+                yield lemma
+            if JSONobject.get("strict") == "1":
+                lemma = {}
+                lemma['extent'] = JSONobject['extent']
+                lemma['scope'] = JSONobject['scope']
+                lemma['state'] = JSONobject['state']
+                lemma["id_word"] = JSONobject["ref"]
+                lemma["id_text"] = id_text
+                yield lemma
+        else:   # end of this level
+            if not stack:
+                meta_d["label"] = label
+                return
+            nodes, saved, walked = stack.pop()
+            if walked is not None:
+                stack.append((nodes, None, None))
+                nodes = iter((walked,))
+                capture_field = saved
+
+def parsejson(text, meta_d):
+    return list(iter_lemmas(text, meta_d))
+
+def read_json(z, filename):
+    """Decodes the JSON member `filename` of the open ZIP 
+    `z` straight from its bytes, with orjson if installed."""
+    return loads(z.read(filename))
+
+def keep_lemma(lemma, lang = None, skip_fields = None):
+    """Returns True if `lemma` passes the filters of 
+    get_lemmas(): its `lang` contains one of the strings
+    in `lang`, and its `field` is not in `skip_fields`."""
+    if lang and not any(l in (lemma.get('lang') or '') for l in lang):
+        return False
+    if skip_fields and (lemma.get('field') or '') in skip_fields:
+        return False
+    return True
+
+def select_members(z, project, names, texts = None, lemmatized = False):
+    """Returns the member `names` of the open ZIP `z` 
+    that are to be parsed: those of the texts in `texts`
+    (P, Q, or X numbers, or full text ids such as 
+    'dcclt/P117394'), and/or, with `lemmatized` = True,
+    those of the texts listed as lemmatized (formats 
+    'lem') in the project's metadata.json."""
+    if texts is not None:
+        texts = set(texts)
+        names = [name for name in names 
+                    if name[-12:-5] in texts or project + name[-13:-5] in texts]
+    if lemmatized:
+        try:
+            lem = set(read_json(z, f"{project}/metadata.json")["formats"]["lem"])
+        except (KeyError, ValueError):
+            print(f"{project}: no list of lemmatized texts in metadata.json")
+            lem = set()
+        names = [name for name in names if name[-12:-5] in lem]
+    return names
+
+def lemma_filters(lang = None, skip_fields = None):
+    """Returns the `where` argument of parse_member() for
+    the filters `lang` (a string or a list of strings) and
+    `skip_fields`, or None if there are no filters."""
+    if isinstance(lang, str):
+        lang = [lang]
+    return {key : sorted(value) for key, value in 
+                (("lang", lang), ("skip_fields", skip_fields)) if value} or None
+
+def content_hash(data):
+    """Returns a hash of the text in the bytes of a 
+    corpusjson member: of its parsed lemmas (the COLUMNS
+    other than id_text), so that copies of a text in 
+    different projects have the same hash if their text
+    and lemmatization are the same, even though the JSON
+    names the project (in its header and in the `sig` of
+    each word)."""
+    try:
+        rows = parsejson(loads(data), {"label": None, "id_text": None})
+    except Exception:   # reported when the text is parsed
+        return hashlib.sha1(data).hexdigest()
+    columns = columns_from_rows(rows, [col for col in COLUMNS if col != 'id_text'])
+    return hashlib.sha1(repr(columns).encode('utf-8')).hexdigest()
+
+DUPLICATES = [] # copies skipped by the last get_lemmas() or iter_texts(); see find_duplicates()
+
+def find_duplicates(project_list, priority = None, by = "id", texts = None, lemmatized = False):
+    """Finds the texts (P, Q, or X numbers) that are in
+    more than one of the downloaded projects in
+    `project_list`, before anything is parsed. The copy
+    that is kept is the one in the project that comes
+    first in `priority` (a list of project names);
+    projects not in `priority` come after it, in the
+    order of `project_list`. With `by` = "id" only that
+    copy is kept; with `by` = "content" other copies are
+    skipped only if they are identical to it (see
+    content_hash()), so that copies with a different
+    text or lemmatization are still parsed. For `texts`
+    and `lemmatized` see select_members().
+
+    Returns a dictionary with the set of member names to
+    skip in each project, and a list with a dictionary
+    for each copy found: its `id_text`, the `project` it
+    is in, the project whose copy is `kept`, whether it
+    is `identical` to that copy (None with `by` = "id",
+    which does not read the copies), and whether it is 
+    `skipped`."""
+    rank = {project : i for i, project in enumerate(priority or [])}
+    order = sorted(project_list, key = lambda project: rank.get(project, len(rank)))
+    copies = {}  # text number: [(project, member name)], in order of priority
+    for project in order:
+        try:
+            z = open_archive(project_archive(project))
+        except Exception:
+            continue    # reported by the parser
+        with z:
+            names = [name for name in z.namelist() if "corpusjson" in name and name[-5:] == '.json']
+            for name in select_members(z, project, names, texts, lemmatized):
+                copies.setdefault(name[-12:-5], []).append((project, name))
+    copies = {number : found for number, found in copies.items() if len(found) > 1}
+    # only the texts that are in more than one project are read,
+    # and only if the content decides what is skipped
+    hashes = {}
+    for project in (order if by == "content" else []):
+        names = [name for found in copies.values() for p, name in found if p == project]
+        if names:
+            with open_archive(project_archive(project)) as z:
+                for name in names:
+                    hashes[project, name] = content_hash(z.read(name))
+    skip = {}
+    report = []
+    for number, ((kept, kept_name), *others) in copies.items():
+        for project, name in others:
+            identical = hashes[project, name] == hashes[kept, kept_name] if by == "content" else None
+            skipped = identical or by != "content"
+            if skipped:
+                skip.setdefault(project, set()).add(name)
+            report.append({"id_text" : project + name[-13:-5], "project" : project,
+                           "kept" : kept + kept_name[-13:-5], "identical" : identical,
+                           "skipped" : skipped})
+    return skip, report
+
+def skip_duplicates(project_list, dedupe = None, priority = None, texts = None, lemmatized = False):
+    """Returns the member names to skip in each project 
+    with `dedupe` = "id" or "content" (see get_lemmas()),
+    keeps the list of skipped copies in DUPLICATES, and 
+    prints a summary."""
+    if not dedupe:
+        return {}
+    skip, report = find_duplicates(project_list, priority, dedupe, texts, lemmatized)
+    DUPLICATES[:] = [copy for copy in report if copy["skipped"]]
+    if report:
+        if dedupe == "content":
+            print(f"{len(DUPLICATES)} duplicate texts skipped (identical to the copy kept), "
+                  f"{len(report) - len(DUPLICATES)} different copies parsed")
+        else:
+            print(f"{len(DUPLICATES)} duplicate texts skipped")
+        for project, names in skip.items():
+            print(f"{project}: {len(names)} texts skipped")
+    return skip
+
+def parse_member(z, project, filename, meta_d, columns = None, where = None, lines = False):
+    """Parses one corpusjson member of the open ZIP `z`.
+    Returns a list of lemmas, or, if a list of `columns`
+    is given, a dictionary with one list of values per
+    column (see COLUMNS and columns_from_rows()). With
+    `lines` = True the result is a dictionary of columns
+    with one row per line instead (see lines_from_rows()).
+    Lemmas that do not pass the filters in the dictionary
+    `where` (see keep_lemma()) are left out. Returns 
+    None if the text could not be parsed."""
+    id_text = project + filename[-13:-5] 
+    meta_d["id_text"] = id_text
+    try:
+        data_json = read_json(z, filename)
+        if where:
+            rows = [row for row in iter_lemmas(data_json, meta_d, carry_label=lines) 
+                        if keep_lemma(row, **where)]
+        elif lines:
+            rows = list(iter_lemmas(data_json, meta_d, carry_label=True))
+        else:
+            rows = parsejson(data_json, meta_d)
+        if lines:
+            return lines_from_rows(rows)
+        if columns is None:
+            return rows
+        return columns_from_rows(rows, columns)
+    except:
+        e = sys.exc_info() # get error information
+        print(filename), print(e[0]), print(e[1]) # and print it
+        #print(f'{id_text} is not available or not complete')
+        return None
+
+# columns with (nearly) unique values, which are not interned
+UNIQUE = {'id_word'}
+
+def columns_from_rows(rows, columns):
+    """Returns a dictionary with a list of values for 
+    each of the `columns`, plus `id_line` (the line 
+    number taken from id_word). Missing values become 
+    ''; the normalization of `gw` and `sense` that 
+    dataformat() applies to a list of lemmas (spaces 
+    become hyphens, commas are removed) is done here.
+    Only the values are kept, not the JSON objects they
+    come from, and repeated strings (such as 'sux' or
+    'N') are interned, so that every occurrence refers
+    to the same object."""
+    intern = sys.intern
+    cols = {col : [row.get(col) or '' for row in rows] for col in columns}
+    for col in ('gw', 'sense'):
+        if col in cols:
+            cols[col] = [value.replace(' ', '-').replace(',', '') for value in cols[col]]
+    for col, values in cols.items():
+        if col not in UNIQUE:
+            cols[col] = [intern(value) if type(value) is str else value for value in values]
+    cols['id_line'] = [int(row['id_word'].split('.')[1]) for row in rows]
+    return cols
+
+def lemma_string(row):
+    """Returns the lemma of a row of the parser, as in 
+    2.1.4: cf[gw]pos (for instance lugal[king]N), or 
+    form[NA]NA if the word has no citation form, or 
+    form[]NU for numbers; '' if there is no form (as in
+    rows that represent breakage)."""
+    form = row.get('form') or ''
+    pos = row.get('pos') or ''
+    if pos == 'n':
+        return f"{form}[]NU"
+    if not form:
+        return ''
+    cf = row.get('cf') or ''
+    if not cf:
+        return f"{form}[NA]NA"
+    gw = (row.get('gw') or '').replace(' ', '-').replace(',', '')
+    return f"{cf}[{gw}]{pos}"
+
+# the columns of the line-by-line output of the parser
+LINES = ['id_text', 'id_line', 'label', 'lemma', 'extent', 'scope', 'state']
+
+def lines_from_rows(rows):
+    """Returns a dictionary with a list of values for
+    each of the columns in LINES, with one row per line,
+    in the order in which the lines appear in the text.
+    `lemma` holds the lemmas of the line (see 
+    lemma_string()), separated by spaces, and `extent`,
+    `scope`, and `state` the (joined) information on 
+    broken lines. The result is the same as grouping 
+    the words by id_text, id_line, and label and joining
+    these fields (as in 2.1.4), but without building the
+    table of words."""
+    intern = sys.intern
+    lines = {}
+    for row in rows:
+        key = (row['id_text'], int(row['id_word'].split('.')[1]), row.get('label') or '')
+        line = lines.get(key)
+        if line is None:
+            line = lines[key] = ([], [], [], [])
+        line[0].append(lemma_string(row))
+        line[1].append(row.get('extent') or '')
+        line[2].append(row.get('scope') or '')
+        line[3].append(row.get('state') or '')
+    cols = {col : [] for col in LINES}
+    for (id_text, id_line, label), (lemmas, extent, scope, state) in lines.items():
+        cols['id_text'].append(intern(id_text))
+        cols['id_line'].append(id_line)
+        cols['label'].append(intern(label))
+        cols['lemma'].append(' '.join(lemmas))
+        cols['extent'].append(intern(''.join(extent)))
+        cols['scope'].append(intern(''.join(scope)))
+        cols['state'].append(intern(''.join(state)))
+    return cols
+
+def new_lemmas(columns = None):
+    return {col : [] for col in dict.fromkeys(list(columns) + ['id_line'])} if columns else []
+
+def extend_columns(cols, more):
+    """Appends the columns `more` to the columns `cols`."""
+    for col, values in more.items():
+        cols.setdefault(col, []).extend(values)
+
+def add_text(lemm, text):
+    """Adds a parsed text (see parse_member()) to a list
+    of lemmas or to a dictionary of columns."""
+    if text is None:
+        return
+    if isinstance(lemm, dict):
+        extend_columns(lemm, text)
+    else:
+        lemm.extend(text)
+
+def parse_members(file, project, names, t = None, columns = None, split = False, where = None,
+                  lines = False):
+    """Parses the corpusjson members `names` of the 
+    project ZIP `file` and returns a list of lemmas 
+    (or a dictionary of columns; see parse_member()).
+    The ZIP is opened here, so that each worker process
+    in get_lemmas() has its own file handle. `t` is an
+    optional progress bar. If `split` is True, the 
+    result is a dictionary with the parsed text of each
+    member name instead. For `where` and `lines` see 
+    parse_member()."""
+    lemm = {} if split else new_lemmas(LINES if lines else columns)
     meta_d = {"label": None, "id_text": None}
+    with open_archive(file) as z:
+        for filename in names:
+            text = parse_member(z, project, filename, meta_d, columns, where, lines)
+            if split:
+                lemm[filename] = text
+            else:
+                add_text(lemm, text)
+            if t is not None:
+                t.update()
+    return lemm
+
+def parse_project(file, project, names, t = None, columns = None, workers = 1, split = False,
+                  where = None, lines = False):
+    """Parses the members `names` of a project ZIP, like
+    parse_members(). With `workers` > 1 the members are
+    divided over that many processes; the results are 
+    merged in the original order of the texts."""
+    if workers <= 1 or not names:
+        return parse_members(file, project, names, t, columns, split, where, lines)
+    # small shards keep all workers busy until the end
+    size = max(1, len(names) // (workers * 8))
+    shards = [names[i:i + size] for i in range(0, len(names), size)]
+    lemm = {} if split else new_lemmas(LINES if lines else columns)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(parse_members, file, project, shard, None, columns, split, where,
+                                   lines) 
+                        for shard in shards]
+        for shard, future in zip(shards, futures):
+            if split:
+                lemm.update(future.result())
+            else:
+                add_text(lemm, future.result())
+            if t is not None:
+                t.update(len(shard))
+    return lemm
+
+CACHE_VERSION = 3 # raise when the output of the parser changes
+
+def cache_file(project, lines = False):
+    return f"jsonzip/cache/{project.replace('/', '-')}{'-lines' if lines else ''}.p"
+
+def read_cache(project, columns = None, where = None, lines = False):
+    """Returns the parse cache of `project`: a dictionary
+    with, for each member name, the CRC and size of the 
+    member (from the ZIP's central directory) and its 
+    parsed text. The cache is empty if it was made with 
+    other columns, other filters, or another version of 
+    the parser."""
+    try:
+        with open(cache_file(project, lines), 'rb') as p:
+            cache = pickle.load(p)
+    except Exception:
+        return {}
+    if (cache.get("version") != CACHE_VERSION or cache.get("columns") != columns 
+            or cache.get("where") != where):
+        return {}
+    return cache["members"]
+
+def write_cache(project, columns, members, where = None, lines = False):
+    os.makedirs("jsonzip/cache", exist_ok=True)
+    file = cache_file(project, lines)
+    with open(f"{file}.part", 'wb') as p:
+        pickle.dump({"version" : CACHE_VERSION, "columns" : columns, "where" : where,
+                     "members" : members}, 
+                    p, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(f"{file}.part", file)
+
+def get_lemmas(project_list, workers = 1, columns = None, cache = False, 
+               texts = None, lemmatized = False, lang = None, skip_fields = None, lines = False,
+               dedupe = None, priority = None):
+    """Parses the ZIPs of the projects in `project_list`
+    and returns a list of lemmas. With `workers` > 1 the
+    texts of each project are divided over that many 
+    processes; the results are merged in the original
+    order of the texts. If a list of `columns` is given
+    (for instance COLUMNS), each lemma is added directly
+    to per-column lists and the return value is a 
+    dictionary of such lists, which takes much less 
+    memory than a dictionary per lemma. With `cache` = 
+    True the parsed texts are kept in jsonzip/cache; a 
+    text is parsed again only if its CRC or size in the
+    ZIP changed. A project that was packed (see 
+    pack_projects()) is read from its pack instead of 
+    its ZIP.
+
+    The other arguments select data before it is parsed:
+    only the texts in `texts` (a collection of P, Q, or
+    X numbers or text ids) and/or, with `lemmatized` = 
+    True, only the texts listed as lemmatized in each
+    project's metadata.json are read from the ZIP; only
+    lemmas whose `lang` contains `lang` (a string, such
+    as 'sux', or a list of strings) and whose `field` is
+    not in `skip_fields` (for instance ['sg', 'pr']) are
+    kept.
+
+    With `lines` = True the result is a dictionary of 
+    columns with one row per line (see lines_from_rows()
+    and LINES) and `columns` is ignored.
+
+    With `dedupe` = "id" a text that is in more than one
+    of the projects (such as dcclt and its subprojects)
+    is parsed only once, in the first project in 
+    `priority` (a list of project names; by default the
+    order of `project_list`); with `dedupe` = "content"
+    other copies are skipped only if they are identical.
+    A summary is printed; the skipped copies are listed
+    in DUPLICATES (see find_duplicates())."""
+    if lines:
+        columns = None
+    if columns:
+        columns = list(columns)
+    where = lemma_filters(lang, skip_fields)
+    skip = skip_duplicates(project_list, dedupe, priority, texts, lemmatized)
+    lemm_l = new_lemmas(LINES if lines else columns)
     for project in project_list:
-        file = f"jsonzip/{project.replace('/', '-')}.zip"
+        file = project_archive(project)
         try:
-            z = zipfile.ZipFile(file) 
+            z = open_archive(file)
         except:
             e = sys.exc_info() # get error information
             print(file), print(e[0]), print(e[1]) # and print it
@@ -110,35 +1203,694 @@ def get_lemmas(project_list):
             continue
         files = z.namelist()
         files = [name for name in files if "corpusjson" in name and name[-5:] == '.json'] 
-        for filename in tqdm(files, desc = project):
-            id_text = project + filename[-13:-5] 
-            meta_d["id_text"] = id_text
-            try:
-                st = z.read(filename).decode('utf-8')
-                data_json = json.loads(st)           
-                lemm_l.extend(parsejson(data_json, meta_d))
-            except:
-                e = sys.exc_info() # get error information
-                print(filename), print(e[0]), print(e[1]) # and print it
-                #print(f'{id_text} is not available or not complete')
+        files = select_members(z, project, files, texts, lemmatized)
+        if project in skip:
+            files = [name for name in files if name not in skip[project]]
+        info = {i.filename : (i.CRC, i.file_size) for i in z.infolist()}
         z.close()
+        t = tqdm(total=len(files), desc = project)
+        if not cache:
+            add_text(lemm_l, parse_project(file, project, files, t, columns, workers, 
+                                           where=where, lines=lines))
+        else:
+            cached = read_cache(project, columns, where, lines)
+            todo = [name for name in files if name not in cached or cached[name][:2] != info[name]]
+            t.update(len(files) - len(todo))
+            fresh = parse_project(file, project, todo, t, columns, workers, split=True, 
+                                  where=where, lines=lines)
+            # texts that were not selected this time stay in the cache
+            members = {name : entry for name, entry in cached.items() 
+                            if info.get(name) == entry[:2]}
+            for name in files:
+                members[name] = info[name] + (fresh[name],) if name in fresh else cached[name]
+                add_text(lemm_l, members[name][2])
+            if todo or len(members) != len(cached):
+                write_cache(project, columns, {name : entry for name, entry in members.items() 
+                                                    if entry[2] is not None}, where, lines)
+        t.close()
     return(lemm_l)
 
-def dataformat(lemm_list):
-    words_df = pd.DataFrame(lemm_list).fillna('')
-    findreplace = {' ' : '-', ',' : ''}
-    words_df = words_df.replace({'gw' : findreplace, 'sense' : findreplace}, regex=True)
-    words_df['id_line'] = [int(wordid.split('.')[1]) for wordid in words_df['id_word']] 
+# columns with few distinct values, stored as categoricals 
+# by dataformat() on request
+CATEGORIES = ['lang', 'pos', 'field', 'ftype', 'extent', 'scope', 'state']
+
+def dataformat(lemm_list, categories = False):
+    """Turns the output of get_lemmas() (a list of 
+    lemmas or a dictionary of columns) into a DataFrame,
+    with normalized `gw` and `sense` and the line number
+    `id_line`. With `categories` = True the columns in
+    CATEGORIES become pandas categoricals, which saves 
+    memory but does not allow string concatenation."""
+    if isinstance(lemm_list, dict):  # already normalized; see columns_from_rows()
+        words_df = pd.DataFrame(lemm_list)
+    else:
+        words_df = pd.DataFrame(lemm_list).fillna('')
+        for col in ('gw', 'sense'):
+            if col in words_df:
+                words_df[col] = (words_df[col].str.replace(' ', '-', regex=False)
+                                              .str.replace(',', '', regex=False))
+        words_df['id_line'] = words_df['id_word'].str.split('.', n=2).str[1].astype(int)
+    if categories:
+        for col in CATEGORIES:
+            if col in words_df:
+                words_df[col] = words_df[col].astype('category')
     return(words_df)
 
-def get_data(projects):
+def download_ahead(project_list, q, server = 'penn', workers = 1):
+    """Downloads the projects in `project_list` and puts
+    the name of each project in the queue `q` as soon as
+    its ZIP has landed. None marks the end of the list. 
+    When the queue is full, the downloads wait until the
+    parser has taken the next project from the queue."""
+    try:
+        oracc_download(project_list, server, workers, callback=q.put)
+    finally:
+        q.put(None)
+
+def get_data(projects, server = 'penn', pipeline = False, download_workers = 1, queue_size = 2,
+             workers = 1, columns = COLUMNS, cache = True, categories = False, **filters):
+    """Downloads and parses one or more ORACC projects
+    (a string with project names, separated by commas)
+    and returns a DataFrame with one row per word. With
+    `pipeline` = True the parsing of each project starts
+    as soon as its ZIP has landed, while later projects
+    are still downloading; at most `queue_size` projects
+    wait to be parsed. `download_workers` is the number 
+    of projects downloaded at the same time, `workers`
+    the number of processes that parse the texts of a
+    project (see get_lemmas()). The DataFrame has the
+    `columns` given (default: COLUMNS); with `columns`
+    = None, it keeps every field found in the JSON.
+    Parsed texts are cached (see get_lemmas()), unless
+    `cache` is False. For `categories` see dataformat().
+    Other keyword arguments (`texts`, `lemmatized`, 
+    `lang`, `skip_fields`) select the texts and lemmas
+    to parse; see get_lemmas(). For `lines` see 
+    get_lines(). With `dedupe` (and `priority`) a text
+    that is in more than one project is parsed once (see
+    get_lemmas()); since that needs all ZIPs before the
+    parsing starts, `pipeline` is then ignored."""
     os.makedirs("jsonzip", exist_ok=True)
     os.makedirs("output", exist_ok=True)
     project_list = format_project_list(projects)
-    print("Downloading JSON")
-    project_list = oracc_download(project_list)
-    print("Parsing JSON")
-    lemm_list = get_lemmas(project_list)
-    words_df = dataformat(lemm_list)
+    if pipeline and not filters.get("dedupe"):
+        print("Downloading and parsing JSON")
+        q = queue.Queue(maxsize=queue_size)
+        downloads = threading.Thread(target=download_ahead, daemon=True,
+                                     args=(project_list, q, server, download_workers))
+        downloads.start()
+        lemm_list = new_lemmas(LINES if filters.get("lines") else columns)
+        for project in iter(q.get, None):
+            add_text(lemm_list, get_lemmas([project], workers, columns, cache, **filters))
+        downloads.join()
+    else:
+        print("Downloading JSON")
+        project_list = oracc_download(project_list, server, download_workers)
+        print("Parsing JSON")
+        lemm_list = get_lemmas(project_list, workers, columns, cache, **filters)
+    words_df = dataformat(lemm_list, categories)
     return(words_df)
+
+def get_lines(projects, **kwargs):
+    """Like get_data(), but returns a DataFrame with one
+    row per line (columns: see LINES), in which `lemma` 
+    has the lemmas of the line separated by spaces. The
+    lines are made while parsing, without a table of 
+    words; the result equals
+    
+        words.groupby(['id_text', 'id_line', 'label']).agg(...)
     
+    (as in 2.1.4) except that the lines are in the order
+    of the texts instead of sorted. Keyword arguments are
+    passed on to get_data()."""
+    return get_data(projects, lines = True, **kwargs)
+    
+
+def iter_texts(project_list, columns = None, texts = None, lemmatized = False, 
+               lang = None, skip_fields = None, dedupe = None, priority = None):
+    """Parses the downloaded projects in `project_list` 
+    text by text and yields the id_text and the parsed
+    text (see parse_member()) of each, with a progress
+    bar per project. For the other arguments see 
+    get_lemmas()."""
+    where = lemma_filters(lang, skip_fields)
+    skip = skip_duplicates(project_list, dedupe, priority, texts, lemmatized)
+    meta_d = {"label": None, "id_text": None}
+    for project in project_list:
+        file = project_archive(project)
+        try:
+            z = open_archive(file)
+        except:
+            e = sys.exc_info() # get error information
+            print(file), print(e[0]), print(e[1]) # and print it
+            continue
+        with z:
+            files = [name for name in z.namelist() if "corpusjson" in name and name[-5:] == '.json']
+            files = select_members(z, project, files, texts, lemmatized)
+            if project in skip:
+                files = [name for name in files if name not in skip[project]]
+            for filename in tqdm(files, desc = project):
+                yield project + filename[-13:-5], parse_member(z, project, filename, meta_d, 
+                                                               columns, where)
+
+def iter_data(projects, batch_size = 1000, server = 'penn', download_workers = 1,
+              columns = COLUMNS, categories = False, texts = None, lemmatized = False, 
+              lang = None, skip_fields = None, dedupe = None, priority = None):
+    """Like get_data(), but yields the words of `batch_size`
+    texts at a time, as DataFrames with the same columns
+    (including `id_line`). All words of a text are in the
+    same DataFrame, so that text- and line-level 
+    aggregations can be done batch by batch:
+
+        for words in iter_data("epsd2/admin/ur3"):
+            lines = words.groupby(['id_text', 'id_line']).agg(...)
+
+    Only one batch is in memory at a time; the parse 
+    cache of get_lemmas() is not used."""
+    os.makedirs("jsonzip", exist_ok=True)
+    project_list = oracc_download(format_project_list(projects), server, download_workers)
+    if columns:
+        columns = list(columns)
+    lemm = new_lemmas(columns)
+    n = 0
+    for id_text, text in iter_texts(project_list, columns, texts, lemmatized, lang, skip_fields,
+                                    dedupe, priority):
+        add_text(lemm, text)
+        n += 1
+        if n == batch_size:
+            yield dataformat(lemm, categories)
+            lemm = new_lemmas(columns)
+            n = 0
+    if n:
+        yield dataformat(lemm, categories)
+
+def iter_norm(project_list, **filters):
+    """Parses the downloaded projects in `project_list` 
+    text by text and yields, for each text, its id_text
+    and the text in normalized transcription: the `norm`
+    of each word, or its `form` if there is no `norm` 
+    (as `norm1` in 2.1.4), separated by spaces. Keyword
+    arguments select texts and lemmas (see get_lemmas())."""
+    for id_text, text in iter_texts(project_list, ['norm', 'form'], **filters):
+        if text is not None:
+            yield id_text, ' '.join(norm or form for norm, form in zip(text['norm'], text['form']))
+
+def iter_signs(gdl):
+    """Yields the signs in the `gdl` (the sign-level 
+    analysis of a word in ORACC JSON) in order. A sign 
+    is a GDL node with an `id`: a reading (`v`), a sign
+    name (`s`), a number, compound or qualified sign 
+    (with `form`), or a broken sign (`x`). Determinatives
+    and groups are walked into."""
+    stack = [iter(gdl)]
+    while stack:
+        for node in stack[-1]:
+            if "id" in node:
+                yield node
+            else:
+                stack.append(chain.from_iterable(value for value in node.values() 
+                                                    if isinstance(value, list)))
+                break
+        else:
+            stack.pop()
+
+def sign_reading(node):
+    if "x" in node:
+        return "..." if node["x"] == "ellipsis" else "x"
+    return node.get("v") or node.get("s") or node.get("form") or ""
+
+def get_signs(project_list, signlist = None, columns = COLUMNS, **filters):
+    """Parses the downloaded projects in `project_list` 
+    and returns the table of words (as dataformat()), a
+    table of signs, and the offsets of the signs of each 
+    word. The signs of word i (row i of the table of 
+    words) are rows offsets[i] to offsets[i+1] of the
+    table of signs, which has the columns `reading` (as
+    transliterated, for instance 'ma₂', '5(u)' or 'IL₂')
+    and `name` (the sign name). Sign names are taken
+    from `signlist`, a dictionary from reading to sign 
+    name (such as output/ogsl_dict.p made in 2.4.2), or,
+    for signs transliterated by their name, from the 
+    transliteration; otherwise `name` is ''. Both columns
+    are categoricals (dictionary-encoded); there is no 
+    list of signs per word. Keyword arguments select 
+    texts and lemmas (see get_lemmas())."""
+    signlist = signlist or {}
+    columns = list(columns)
+    lemm = new_lemmas(columns)
+    readings = {}
+    names = {}
+    reading_codes = []
+    name_codes = []
+    offsets = [0]
+    for id_text, rows in iter_texts(project_list, None, **filters):
+        if rows is None:
+            continue
+        for row in rows:
+            for node in iter_signs(row.get("gdl", ())):
+                reading = sign_reading(node)
+                name = node.get("s") or signlist.get(reading, "")
+                reading_codes.append(readings.setdefault(reading, len(readings)))
+                name_codes.append(names.setdefault(name, len(names)))
+            offsets.append(len(reading_codes))
+        add_text(lemm, columns_from_rows(rows, columns))
+    signs = pd.DataFrame({"reading" : pd.Categorical.from_codes(reading_codes, list(readings)),
+                          "name" : pd.Categorical.from_codes(name_codes, list(names))})
+    return dataformat(lemm), signs, np.array(offsets, dtype=np.int64)
+
+def norm_document(id_text, norm1):
+    """Returns the contents of the file of one text, as
+    written by 2.1.4: id_text and the normalized text, 
+    each on a line of its own (in CSV format)."""
+    w = io.StringIO()
+    csv.writer(w, lineterminator='\n').writerows([[id_text], [norm1]])
+    return w.getvalue().encode('utf-8')
+
+def export_norm(project_list, output = "output", workers = 8, **filters):
+    """Saves the texts of the downloaded projects in 
+    `project_list` in normalized transcription (see 
+    iter_norm()), one file per text, named after its 
+    P, Q, or X number (P338628.txt). The texts are 
+    written while they are parsed. If `output` is a 
+    directory the files are written there by `workers` 
+    threads; if it ends in .zip or .tar the files are
+    stored in a single archive. For a .tar archive an
+    index (`output`.index.json) records the offset and
+    size of each file in the archive, so that a file can
+    be read without unpacking. If a P, Q, or X number
+    occurs in more than one project, only the first 
+    text is saved. Keyword arguments select texts and 
+    lemmas (see get_lemmas()). Returns the number of 
+    texts saved."""
+    names = set()
+    skipped = []
+    def documents():
+        for id_text, norm1 in iter_norm(project_list, **filters):
+            name = f'{id_text[-7:]}.txt'
+            if name in names:
+                skipped.append(id_text)
+                continue
+            names.add(name)
+            yield name, norm_document(id_text, norm1)
+    if output.endswith('.zip'):
+        with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as z:
+            for name, data in documents():
+                z.writestr(name, data)
+    elif output.endswith('.tar'):
+        with tarfile.open(output, 'w') as tar:
+            for name, data in documents():
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                info.mtime = time.time()
+                tar.addfile(info, io.BytesIO(data))
+        with tarfile.open(output) as tar:
+            index = {info.name : [info.offset_data, info.size] for info in tar}
+        with open(f"{output}.index.json", 'w', encoding='utf-8') as w:
+            json.dump(index, w)
+    else:
+        os.makedirs(output, exist_ok=True)
+        # at most this many texts wait in memory to be written
+        slots = threading.BoundedSemaphore(workers * 4)
+        def write(file, data):
+            try:
+                with open(file, 'wb') as w:
+                    w.write(data)
+            finally:
+                slots.release()
+        futures = []
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for name, data in documents():
+                slots.acquire()
+                futures.append(executor.submit(write, f'{output}/{name}', data))
+        for future in futures:
+            future.result()
+    if skipped:
+        print(f"{len(skipped)} texts not saved, because a text with the same number was saved before: "
+              f"{', '.join(skipped[:5])}{' ...' if len(skipped) > 5 else ''}")
+    return len(names)
+
+class OraccCorpus(Mapping):
+    """Random access to the texts of one downloaded 
+    project. The ZIP is opened once and indexed; a text
+    is parsed when it is first asked for and the last
+    `cache_size` parsed texts are kept in memory. The 
+    corpus behaves like a (read-only) dictionary with
+    text ids as keys:
+
+        corpus = OraccCorpus("dcclt")
+        lemmas = corpus["dcclt/Q000347"] # or corpus["Q000347"]
+        for id_text, lemmas in corpus.items():
+            ...
+
+    A text is a list of lemmas or, if a list of `columns`
+    is given, a dictionary of columns (see parse_member());
+    None if it could not be parsed. frame() returns 
+    texts as a DataFrame, like get_data()."""
+
+    def __init__(self, project, columns = None, cache_size = 128):
+        self.project = project
+        self.columns = list(columns) if columns else None
+        self.cache_size = cache_size
+        self.zip = open_archive(project_archive(project))
+        self.members = {project + name[-13:-5] : name for name in self.zip.namelist() 
+                            if "corpusjson" in name and name[-5:] == '.json'}
+        self.texts = OrderedDict()
+        self.meta_d = {"label": None, "id_text": None}
+
+    def id_text(self, key):
+        """Returns the text id of `key`, which may also be 
+        a bare P, Q, or X number."""
+        return key if key in self.members else f"{self.project}/{key}"
+
+    def __getitem__(self, key):
+        id_text = self.id_text(key)
+        if id_text in self.texts:
+            self.texts.move_to_end(id_text)
+            return self.texts[id_text]
+        text = parse_member(self.zip, self.project, self.members[id_text], 
+                            self.meta_d, self.columns)
+        if text is not None:
+            self.texts[id_text] = text
+            if len(self.texts) > self.cache_size:
+                self.texts.popitem(last=False)
+        return text
+
+    def __contains__(self, key):
+        return self.id_text(key) in self.members
+
+    def __iter__(self):
+        return iter(self.members)
+
+    def __len__(self):
+        return len(self.members)
+
+    def frame(self, *keys, categories = False):
+        """Returns the texts `keys` (default: all) as a 
+        DataFrame with one row per word (see dataformat())."""
+        lemm = new_lemmas(self.columns)
+        for key in keys or self:
+            add_text(lemm, self[key])
+        return dataformat(lemm, categories)
+
+    def close(self):
+        self.zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class LemmaIndex:
+    """Search for lemmas anywhere in a text, or within a 
+    number of lines, which ORACC search does not offer. 
+    The index is built from a DataFrame with the columns
+    id_text, id_line, and lemma (for instance the output
+    of get_lines(), where `lemma` has all the lemmas of 
+    a line, separated by spaces), or from the glossary of
+    a downloaded project (see from_glossary()):
+
+        index = LemmaIndex(get_lines("epsd2/literary"))
+        index.search("lugal[king]N AND dalla[shine]V/i")
+        index.search("(lugal[king]N OR en[lord]N) AND NOT dalla[shine]V/i")
+        index.search("lugal[king]N dalla[shine]V/i", window = 2)
+
+    A query consists of lemmas (as made by lemma_string())
+    combined with AND, OR, NOT, and parentheses; lemmas 
+    without operator between them are combined with AND.
+    With `window` = n, the lemmas combined by AND must be
+    found within n consecutive lines (by id_line); 
+    window = 1 searches within a single line."""
+
+    def __init__(self, lines = None):
+        self.texts = []      # id_text of each text number
+        self.numbers = {}    # text number of each id_text
+        self.postings = {}   # lemma: {text number: sorted tuple of lines}
+        self.lines = {}      # text number: sorted tuple of lines
+        if lines is not None:
+            self.add(lines["id_text"], lines["id_line"], lines["lemma"])
+
+    def add(self, id_texts, id_lines, lemmas):
+        """Adds lemmas (strings with one or more lemmas, 
+        separated by spaces) to the index."""
+        lines = {}
+        postings = {}
+        for id_text, id_line, lemma in zip(id_texts, id_lines, lemmas):
+            n = self.numbers.get(id_text)
+            if n is None:
+                n = self.numbers[id_text] = len(self.texts)
+                self.texts.append(id_text)
+            lines.setdefault(n, []).append(id_line)
+            for lem in lemma.split():
+                postings.setdefault(lem, {}).setdefault(n, []).append(id_line)
+        # the lines are kept in tuples, which (unlike lists) are
+        # not tracked by the garbage collector; otherwise it 
+        # would walk the whole index from time to time
+        for n, new in lines.items():
+            self.lines[n] = tuple(sorted(set(self.lines.get(n, ())).union(new)))
+        for lem, found in postings.items():
+            old = self.postings.setdefault(lem, {})
+            for n, new in found.items():
+                old[n] = tuple(sorted(set(old.get(n, ())).union(new)))
+
+    @classmethod
+    def from_glossary(cls, project, lang = "sux"):
+        """Builds the index from the glossary `gloss-{lang}.json`
+        in the ZIP of a downloaded project, without parsing 
+        the texts. The glossary lists the references (text 
+        and line) of each instance of each lemma."""
+        with open_archive(project_archive(project)) as z:
+            gloss = read_json(z, f"{project}/gloss-{lang}.json")
+        instances = gloss.get("instances", {})
+        id_texts, id_lines, lemmas = [], [], []
+        for entry in gloss["entries"]:
+            gw = (entry.get("gw") or "").replace(' ', '-').replace(',', '')
+            lemma = f"{entry.get('cf', '')}[{gw}]{entry.get('pos', '')}"
+            for ref in instances.get(entry.get("xis"), []):
+                # references are P100001.5.1 or dcclt:P100001.5.1
+                proj, _, ref = ref.rpartition(':')
+                id_text, id_line = ref.split('.')[:2]
+                id_texts.append(f"{proj or project}/{id_text}")
+                id_lines.append(int(id_line))
+                lemmas.append(lemma)
+        index = cls()
+        index.add(id_texts, id_lines, lemmas)
+        return index
+
+    def search(self, query, window = None):
+        """Returns the id_texts of the texts that match 
+        `query`, in the order in which they were added."""
+        # lemmas such as 5(u)[]NU contain parentheses
+        tokens = re.findall(r'[^\s()]+(?:\([^\s()]*\)[^\s()]*)*|[()]', query)
+        pos = [0]
+        def peek():
+            return tokens[pos[0]] if pos[0] < len(tokens) else None
+        def take():
+            pos[0] += 1
+            return tokens[pos[0] - 1]
+        def expr():
+            node = term()
+            while peek() == "OR":
+                take()
+                node = ("or", node, term())
+            return node
+        def term():
+            node = factor()
+            while peek() not in (None, "OR", ")"):
+                if peek() == "AND":
+                    take()
+                node = ("and", node, factor())
+            return node
+        def factor():
+            token = take() if peek() is not None else None
+            if token == "NOT":
+                return ("not", factor())
+            if token == "(":
+                node = expr()
+                if peek() != ")":
+                    raise ValueError(f"missing ) in {query}")
+                take()
+                return node
+            if token in (None, ")", "AND", "OR"):
+                raise ValueError(f"lemma expected in {query}")
+            return ("lemma", token)
+        tree = expr()
+        if peek() is not None:
+            raise ValueError(f"unexpected {peek()} in {query}")
+        hits, negated = self.evaluate(tree, window)
+        if negated:
+            hits = self.universe(window) - hits
+        found = {n for n in hits} if window is None else {n for n, line in hits}
+        return [self.texts[n] for n in sorted(found)]
+
+    def universe(self, window):
+        if window is None:
+            return set(range(len(self.texts)))
+        return {(n, line) for n, lines in self.lines.items() for line in lines}
+
+    def matches(self, lemma, window):
+        """Returns the text numbers that have `lemma` or, 
+        with a `window`, the (text number, line) pairs of
+        the lines that start a window with `lemma` in it."""
+        postings = self.postings.get(lemma, {})
+        if window is None:
+            return set(postings)
+        hits = set()
+        for n, found in postings.items():
+            lines = self.lines[n]
+            for line in found:
+                start = bisect_left(lines, line - window + 1)
+                hits.update((n, l) for l in lines[start:bisect_right(lines, line)])
+        return hits
+
+    def evaluate(self, node, window):
+        """Returns a set of hits and whether the set is 
+        negated (stands for all hits except these)."""
+        if node[0] == "lemma":
+            return self.matches(node[1], window), False
+        if node[0] == "not":
+            hits, negated = self.evaluate(node[1], window)
+            return hits, not negated
+        (a, a_neg), (b, b_neg) = self.evaluate(node[1], window), self.evaluate(node[2], window)
+        if node[0] == "and":
+            if a_neg and b_neg:
+                return a | b, True
+            if a_neg or b_neg:
+                return (b - a, False) if a_neg else (a - b, False)
+            return a & b, False
+        if a_neg or b_neg:
+            universe = self.universe(window)
+            a, b = (universe - a if a_neg else a), (universe - b if b_neg else b)
+        return a | b, False
+
+def save_corpus(df, file, dictionary = None):
+    """Saves a DataFrame (such as words_df, a table of 
+    lines, or a catalog) as Parquet (if `file` ends in 
+    .parquet) or as an uncompressed Arrow file (.arrow 
+    or .feather), which can be memory-mapped by 
+    load_corpus(). String columns are dictionary-encoded:
+    each distinct value (an id_text, pos, lang, gw...) 
+    is stored once. `dictionary` is the list of columns
+    to encode; by default all string columns with fewer
+    distinct values than half the number of rows. 
+    Requires pyarrow."""
+    if pa is None:
+        raise ImportError("save_corpus() requires pyarrow (pip install pyarrow)")
+    table = pa.Table.from_pandas(df)
+    if dictionary is None:
+        dictionary = [col for col in df.columns 
+                        if (df[col].dtype == object or pd.api.types.is_string_dtype(df[col]))
+                        and df[col].map(type).eq(str).all()
+                        and df[col].nunique() < len(df) / 2]
+    if file.endswith('.parquet'):
+        pq.write_table(table, file, use_dictionary=list(dictionary))
+    else:
+        for col in dictionary:
+            i = table.schema.get_field_index(col)
+            table = table.set_column(i, col, table.column(i).dictionary_encode())
+        feather.write_feather(table, file, compression='uncompressed')
+
+def load_corpus(file, columns = None, memory_map = True, categories = False):
+    """Loads a corpus saved by save_corpus(). Only the 
+    `columns` listed are read (default: all), so that
+    a notebook that needs only id_text and lemma does 
+    not pay for the whole table. Files are memory-mapped
+    unless `memory_map` is False. Dictionary-encoded 
+    columns become pandas categoricals if `categories` 
+    is True, and ordinary string columns otherwise.
+    Requires pyarrow."""
+    if pa is None:
+        raise ImportError("load_corpus() requires pyarrow (pip install pyarrow)")
+    if file.endswith('.parquet'):
+        read_dictionary = None
+        if categories:
+            # only the columns that save_corpus() stored dictionary-encoded
+            meta = pq.ParquetFile(file).metadata
+            read_dictionary = [meta.schema.column(i).name for i in range(meta.num_columns)
+                                if meta.num_row_groups and 
+                                    {'RLE_DICTIONARY', 'PLAIN_DICTIONARY'} & 
+                                    set(meta.row_group(0).column(i).encodings)
+                                and (columns is None or meta.schema.column(i).name in columns)]
+        table = pq.read_table(file, columns=columns, memory_map=memory_map, 
+                              read_dictionary=read_dictionary)
+    else:
+        table = feather.read_table(file, columns=columns, memory_map=memory_map)
+    df = table.to_pandas()
+    if not categories:
+        for col, dtype in df.dtypes.items():
+            if isinstance(dtype, pd.CategoricalDtype):
+                df[col] = df[col].astype(dtype.categories.dtype)
+    return df
+
+def catalogue_file(project):
+    return f"jsonzip/cache/{project.replace('/', '-')}-catalogue.p"
+
+def read_catalogue(project, fields = None, cache = True):
+    """Reads the catalogue.json of a downloaded project
+    and returns the text ids and a dictionary with a 
+    list of values for each of the `fields` (default: 
+    all fields), with None where a text lacks a field.
+    With `cache` = True the result is kept in 
+    jsonzip/cache and re-used as long as the CRC and 
+    size of catalogue.json in the ZIP are unchanged. The
+    catalogue is read from the project's pack, if there 
+    is one (see pack_projects())."""
+    name = f"{project}/catalogue.json"
+    with open_archive(project_archive(project)) as z:
+        info = z.getinfo(name)
+        key = (info.CRC, info.file_size, fields)
+        if cache:
+            try:
+                with open(catalogue_file(project), 'rb') as p:
+                    cached = pickle.load(p)
+                if cached["key"] == key:
+                    return cached["ids"], cached["columns"]
+            except Exception:
+                pass
+        members = read_json(z, name)["members"]
+    ids = list(members)
+    if fields is None:
+        fields = list(dict.fromkeys(chain.from_iterable(members.values())))
+    columns = {field : [meta.get(field) for meta in members.values()] for field in fields}
+    if cache:
+        os.makedirs("jsonzip/cache", exist_ok=True)
+        file = catalogue_file(project)
+        with open(f"{file}.part", 'wb') as p:
+            pickle.dump({"key" : key, "ids" : ids, "columns" : columns}, 
+                        p, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(f"{file}.part", file)
+    return ids, columns
+
+def get_catalogue(projects, fields = None, workers = 4, cache = True):
+    """Returns the catalogues of one or more downloaded
+    projects (a string with project names, separated by
+    commas, or a list) as one DataFrame, with a row per 
+    text (indexed by text id), a column for each of the
+    `fields` (default: all fields found) and a column 
+    `project`. Missing values are None. The catalogues
+    are read by `workers` threads at the same time; for
+    `cache` see read_catalogue()."""
+    if isinstance(projects, str):
+        projects = format_project_list(projects)
+    if fields:
+        fields = tuple(fields)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(read_catalogue, project, fields, cache) for project in projects]
+    ids = []
+    columns = {}
+    project_col = []
+    for project, future in zip(projects, futures):
+        try:
+            p_ids, p_columns = future.result()
+        except:
+            e = sys.exc_info() # get error information
+            print(project), print(e[0]), print(e[1]) # and print it
+            continue
+        for field, values in p_columns.items():
+            columns.setdefault(field, [None] * len(ids)).extend(values)
+        ids.extend(p_ids)
+        project_col.extend([project] * len(p_ids))
+        for values in columns.values():
+            values.extend([None] * (len(ids) - len(values)))
+    columns["project"] = project_col
+    return pd.DataFrame(columns, index=ids)